@@ -1,14 +1,38 @@
 import os
-import requests
+import logging
+import asyncio
+from github_client import session, get_json_cached
 from pinecone import Pinecone, ServerlessSpec
-from transformers import RobertaTokenizer, RobertaModel
+from transformers import AutoTokenizer, RobertaModel
 import torch
-import base64
+import numpy as np
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+# Set CODEBERT_INT8=0 to run CodeBERT in full FP32 precision (INT8 quantization is CPU-only)
+USE_INT8 = DEVICE == 'cpu' and os.environ.get("CODEBERT_INT8", "1") == "1"
+
+# Quantized Linear layers expect FP32 inputs, so bf16 autocast is only used without INT8
+USE_BF16 = not USE_INT8
+
+# Set CODEBERT_COMPILE=1 to compile the encoder with torch.compile (PyTorch >= 2.0)
+USE_COMPILE = os.environ.get("CODEBERT_COMPILE", "0") == "1"
+
+# The compiled model sees fixed 512-token inputs; otherwise pad only to the longest file in a batch
+PADDING = 'max_length' if USE_COMPILE else True
+
+# ETag cache file for this script, separate from scrapping.py's so both can run at once
+CACHE_PATH = '.gh_cache_analyzer'
 
 # Initialize Pinecone
 def initialize_pinecone(index_name, dimension=768):
-    # Debug print statement
-    print("Inside initialize_pinecone")
+    log.debug("Inside initialize_pinecone")
 
     pc = Pinecone(api_key=os.environ.get("PINECONE_KEY"))
 
@@ -24,13 +48,19 @@ def initialize_pinecone(index_name, dimension=768):
             )
         )
     
-    index = pc.Index(index_name)
+    # pool_threads lets async_req upserts run concurrently
+    index = pc.Index(index_name, pool_threads=30)
     return index
 
+# File extensions to prioritize (a tuple, so str.endswith can check them all at once)
+PRIORITIZED_EXTENSIONS = ('.py', '.js', '.java', '.cpp', '.c', '.ts', '.rb', '.php')
+
+# Skip overly large files (in bytes, as reported by the tree listing)
+FILE_SIZE_THRESHOLD = 1024 * 1024
+
 # Function to extract GitHub username from the profile URL
 def extract_username(github_url):
-    # Debug print statement
-    print("Inside extract username")
+    log.debug("Inside extract username")
 
     if "github.com/" in github_url:
         return github_url.split("github.com/")[1].split('/')[0]
@@ -39,130 +69,240 @@ def extract_username(github_url):
 
 # Function to get repositories for a user with GitHub token for authentication
 def get_repositories(username, token):
-    # Debug print statement
-    print("Inside get_repositories")
+    log.debug("Inside get_repositories")
 
     url = f"https://api.github.com/users/{username}/repos"
     headers = {'Authorization': f'token {token}'}
     
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch repositories for {username}, status code: {response.status_code}")
+    status_code, repos = get_json_cached(url, headers, CACHE_PATH)
+    if status_code != 200:
+        raise Exception(f"Failed to fetch repositories for {username}, status code: {status_code}")
     
-    repos = response.json()
     return repos
 
 # Function to prioritize files based on their extension, with GitHub token for authentication
-def prioritize_files(username, repo_name, token):
-    # Debug print statement
-    print("Inside prioritize_files")
+def prioritize_files(username, repo_name, token, branch):
+    log.debug("Inside prioritize_files")
 
-    branches = ['main', 'master']
-    files = []
+    # A single recursive Git Trees call lists every file in the repository
+    tree_url = f"https://api.github.com/repos/{username}/{repo_name}/git/trees/{branch}?recursive=1"
+    headers = {'Authorization': f'token {token}'}
     
-    for branch in branches:
-        tree_url = f"https://api.github.com/repos/{username}/{repo_name}/git/trees/{branch}?recursive=1"
-        headers = {'Authorization': f'token {token}'}
-        
-        response = requests.get(tree_url, headers=headers)
-        
-        if response.status_code == 200:
-            files = response.json().get('tree', [])
-            print(f"Successfully fetched file tree from branch: {branch}")
-            break
-        else:
-            print(f"Failed to fetch file tree from branch: {branch}, status code: {response.status_code}")
-            if response.status_code == 404 and branch == 'main':
-                # If 'main' branch fails, continue to check 'master'
-                continue
-            elif response.status_code != 404:
-                # If the error is not a 404, raise an exception
-                raise Exception(f"Failed to fetch file tree for {repo_name} from branch {branch}, status code: {response.status_code}")
-
-    if not files:
-        raise Exception(f"Failed to fetch file tree for {repo_name} from both branches: 'main' and 'master'")
+    status_code, tree = get_json_cached(tree_url, headers, CACHE_PATH)
+    if status_code != 200:
+        raise Exception(f"Failed to fetch file tree for {repo_name} from branch {branch}, status code: {status_code}")
+
+    files = tree.get('tree', [])
     
     code_files = []
-    
-    # Define file extensions to prioritize
-    prioritized_extensions = ['.py', '.js', '.java', '.cpp', '.c', '.ts', '.rb', '.php']
 
-    # Process the files and filter/prioritize
+    # Filter the single tree listing by type, extension and size, with no further requests
     for file in files:
-        if file['type'] == 'blob':  # Ensure it's a file, not a directory
+        if file['type'] == 'blob' and file['path'].endswith(PRIORITIZED_EXTENSIONS) and file.get('size', 0) < FILE_SIZE_THRESHOLD:
             file_path = file['path']
-            file_size_kb = file.get('size', 0) / 1024
-            
-            # Prioritize based on extension
-            if any(file_path.endswith(ext) for ext in prioritized_extensions):
-                # Skip overly large files (example: more than 1 MB)
-                if file_size_kb < 1 * 1024:
-                    code_files.append({'file': file_path, 'size_kb': file_size_kb})
+            download_url = f"https://raw.githubusercontent.com/{username}/{repo_name}/{branch}/{quote(file_path)}"
+            code_files.append({'file': file_path, 'size_kb': file['size'] / 1024, 'sha': file['sha'], 'download_url': download_url})
 
     return code_files
 
 
 # Function to fetch the content of a file from GitHub
-def get_file_content(username, repo_name, file_path, token):
-    # Debug print statement
-    print("Inside get_file_content")
+def get_file_content(download_url, token):
+    log.debug("Inside get_file_content")
 
-    url = f"https://api.github.com/repos/{username}/{repo_name}/contents/{file_path}"
+    # raw.githubusercontent.com serves the bytes directly: no base64/JSON wrapping and no REST quota
     headers = {'Authorization': f'token {token}'}
     
-    response = requests.get(url, headers=headers)
+    response = session.get(download_url, headers=headers)
     if response.status_code == 200:
-        content = response.json().get('content', '')
-        # Decode base64 content
-        content = base64.b64decode(content).decode('utf-8')
-        return content
+        return response.text
     else:
-        print(f"Failed to fetch content for {file_path}, status code: {response.status_code}")
+        log.warning("Failed to fetch content for %s, status code: %d", download_url, response.status_code)
         return None
 
+# Function to load CodeBERT once per process; later calls reuse the same tokenizer and model
+@lru_cache(maxsize=1)
+def load_codebert():
+    # Rust-backed fast tokenizer; a list of texts is tokenized in parallel
+    tokenizer = AutoTokenizer.from_pretrained('microsoft/codebert-base', use_fast=True)
+    model = RobertaModel.from_pretrained('microsoft/codebert-base')
+    # Inference only: no dropout, and no autograd state on the weights
+    model.eval()
+    model.requires_grad_(False)
+    if DEVICE == 'cuda':
+        model = model.to(DEVICE, dtype=torch.bfloat16)
+    elif USE_INT8:
+        # Dynamic INT8 quantization of the Linear layers; LayerNorm/GELU stay in FP32
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if USE_COMPILE:
+        model = torch.compile(model, mode='reduce-overhead', dynamic=True)
+        # Warm up on a full-length input so the compiled graph is cached before the first real batch
+        dummy = tokenizer(['warmup'], return_tensors='pt', padding='max_length', max_length=512, return_token_type_ids=False).to(DEVICE)
+        with torch.inference_mode(), torch.autocast(device_type=DEVICE, dtype=torch.bfloat16, enabled=USE_BF16):
+            model(**dummy)
+    return tokenizer, model
+
 # Function to initialize CodeBERT model
 def initialize_codebert():
-    # Debug print statement
-    print("Inside initialize_codebert")
+    log.debug("Inside initialize_codebert")
 
-    tokenizer = RobertaTokenizer.from_pretrained('microsoft/codebert-base')
-    model = RobertaModel.from_pretrained('microsoft/codebert-base')
-    return tokenizer, model
+    return load_codebert()
 
 # Function to convert text to vector embeddings using CodeBERT
 def get_embedding(text, tokenizer, model):
-    # Debug print statement
-    print("Inside get_embedding")
+    log.debug("Inside get_embedding")
 
-    inputs = tokenizer(text, return_tensors='pt', truncation=True, padding=True)
-    with torch.no_grad():
+    # A single sequence needs no padding, except to keep shapes static for the compiled model
+    inputs = tokenizer(text, return_tensors='pt', truncation=True, max_length=512, padding='max_length' if USE_COMPILE else False, return_attention_mask=True, return_token_type_ids=False).to(DEVICE)
+    with torch.inference_mode(), torch.autocast(device_type=DEVICE, dtype=torch.bfloat16, enabled=USE_BF16):
         outputs = model(**inputs)
-    # Use the mean of the hidden states as the embedding
-    embeddings = outputs.last_hidden_state.mean(dim=1)
-    return embeddings.squeeze().numpy()
+    # Use the masked mean of the hidden states as the embedding, ignoring any padding
+    mask = inputs['attention_mask'].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+    embeddings = (outputs.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1)
+    return embeddings.squeeze().float().cpu().numpy()
 
-# Function to store prioritized files in Pinecone
-def store_prioritized_files_in_pinecone(username, repo_name, prioritized_files, token, pinecone_index, tokenizer, model):
-    # Debug print statement
-    print("Inside store_prioritized_files_in_pinecone")
+# Function to split an iterable into lists of at most batch_size items
+def chunks(iterable, batch_size=100):
+    it = iter(iterable)
+    chunk = list(islice(it, batch_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(it, batch_size))
 
-    for file_info in prioritized_files:
-        file_path = file_info['file']
-        file_content = get_file_content(username, repo_name, file_path, token)
-        
+# Function to convert a batch of texts to vector embeddings using a single CodeBERT forward pass
+def get_embeddings_batch(texts, tokenizer, model):
+    inputs = tokenizer(texts, return_tensors='pt', truncation=True, padding=PADDING, max_length=512, return_attention_mask=True, return_token_type_ids=False).to(DEVICE)
+    with torch.inference_mode(), torch.autocast(device_type=DEVICE, dtype=torch.bfloat16, enabled=USE_BF16):
+        outputs = model(**inputs)
+    # Masked mean of the hidden states, so padding tokens don't dilute shorter files
+    mask = inputs['attention_mask'].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+    embeddings = (outputs.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1)
+    return embeddings.float().cpu().numpy()
+
+# Pipeline stage: download file contents concurrently and queue them for embedding
+async def download_files(prioritized_files, token, file_queue, download_executor, max_workers):
+    loop = asyncio.get_running_loop()
+    # Keeps at most max_workers downloads in flight, one per executor thread
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def download(file_info):
+        async with semaphore:
+            file_content = await loop.run_in_executor(download_executor, get_file_content, file_info['download_url'], token)
         if file_content:
-            # Convert file content to vector embedding using CodeBERT
-            embedding = get_embedding(file_content, tokenizer, model)
-            # Create a unique ID for the file (can be a combination of repo name + file path)
-            vector_id = f"{repo_name}/{file_path}"
-            
-            # Store the embedding in Pinecone along with metadata
-            pinecone_index.upsert(vectors=[(vector_id, embedding)], metadata={'repo_name': repo_name, 'file_path': file_path})
+            await file_queue.put((file_info, file_content))
+
+    await asyncio.gather(*(download(file_info) for file_info in prioritized_files))
+    await file_queue.put(None)
+
+# Pipeline stage: embed queued files in batches and queue the resulting vectors for upserting,
+# returning how many vectors were queued
+async def embed_files(repo_name, tokenizer, model, file_queue, vector_queue, embed_executor, batch_size, seen_shas):
+    loop = asyncio.get_running_loop()
+    queued_count = 0
+    done = False
+    while not done:
+        batch = []
+        # Wait for one file, then take whatever else is already queued up to batch_size
+        while len(batch) < batch_size and (not batch or not file_queue.empty()):
+            item = await file_queue.get()
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+
+        if batch:
+            file_infos = [file_info for file_info, _ in batch]
+            file_contents = [file_content for _, file_content in batch]
+            # Convert the whole batch of file contents to vector embeddings using CodeBERT
+            embeddings = await loop.run_in_executor(embed_executor, get_embeddings_batch, file_contents, tokenizer, model)
+            for file_info, embedding in zip(file_infos, embeddings):
+                # The git blob sha identifies the content, so identical files share one vector
+                vector_id = file_info['sha']
+                # fp16 precision keeps cosine similarity > 0.99 and shortens the serialized upsert payload
+                values = embedding.astype(np.float16).tolist()
+                await vector_queue.put((vector_id, values, {'repo_name': repo_name, 'file_path': file_info['file']}))
+                # Only now is the content covered; a failed download leaves later copies eligible
+                seen_shas.add(vector_id)
+                queued_count += 1
+
+    await vector_queue.put(None)
+    return queued_count
+
+# Pipeline stage: send queued vectors to Pinecone as parallel upserts
+async def upsert_vectors(pinecone_index, vector_queue, upsert_batch_size):
+    async_results = []
+    batch = []
+    while True:
+        vector = await vector_queue.get()
+        if vector is not None:
+            batch.append(vector)
+        if batch and (vector is None or len(batch) == upsert_batch_size):
+            async_results.append(pinecone_index.upsert(vectors=batch, async_req=True))
+            batch = []
+        if vector is None:
+            break
+
+    for result in async_results:
+        await asyncio.to_thread(result.get)
+
+# Function to run the download -> embed -> upsert pipeline for one repository, returning the number of vectors stored
+async def store_files_pipeline(username, repo_name, prioritized_files, token, pinecone_index, tokenizer, model, seen_shas, batch_size, upsert_batch_size, max_workers, queue_size):
+    # Bounded queues keep at most queue_size file contents / vectors in memory
+    file_queue = asyncio.Queue(maxsize=queue_size)
+    vector_queue = asyncio.Queue(maxsize=queue_size)
+    # Separate executors, so the torch forward never waits behind queued downloads
+    with ThreadPoolExecutor(max_workers=max_workers) as download_executor, ThreadPoolExecutor(max_workers=1) as embed_executor:
+        _, stored_count, _ = await asyncio.gather(
+            download_files(prioritized_files, token, file_queue, download_executor, max_workers),
+            embed_files(repo_name, tokenizer, model, file_queue, vector_queue, embed_executor, batch_size, seen_shas),
+            upsert_vectors(pinecone_index, vector_queue, upsert_batch_size),
+        )
+    return stored_count
+
+# Function to drop files whose content (git blob sha) already has a vector queued this run or stored in Pinecone
+def filter_new_files(prioritized_files, pinecone_index, seen_shas):
+    new_files = []
+    listed_shas = set()
+    for file_info in prioritized_files:
+        if file_info['sha'] not in seen_shas and file_info['sha'] not in listed_shas:
+            listed_shas.add(file_info['sha'])
+            new_files.append(file_info)
+
+    for batch in chunks([file_info['sha'] for file_info in new_files], 100):
+        seen_shas.update(pinecone_index.fetch(ids=batch).vectors)
+
+    return [file_info for file_info in new_files if file_info['sha'] not in seen_shas]
+
+# One-off migration: delete vectors stored under the old "repo_name/file_path" ids (before ids became
+# blob shas), once the file's content is covered by a sha-keyed vector. Only needed for indexes built
+# before that change, so it runs only when migrate_legacy_ids is set (MIGRATE_LEGACY_IDS=1 from the CLI)
+def delete_legacy_vectors(repo_name, prioritized_files, pinecone_index, seen_shas):
+    legacy_ids = [f"{repo_name}/{file_info['file']}" for file_info in prioritized_files if file_info['sha'] in seen_shas]
+    for batch in chunks(legacy_ids, 1000):
+        pinecone_index.delete(ids=batch)
+
+# Async entry point for storing prioritized files in Pinecone, for callers that already run an event loop
+async def store_prioritized_files_in_pinecone_async(username, repo_name, prioritized_files, token, pinecone_index, tokenizer, model, seen_shas=None, migrate_legacy_ids=False, batch_size=16, upsert_batch_size=100, max_workers=32, queue_size=64):
+    if seen_shas is None:
+        seen_shas = set()
+    new_files = await asyncio.to_thread(filter_new_files, prioritized_files, pinecone_index, seen_shas)
+
+    stored_count = await store_files_pipeline(username, repo_name, new_files, token, pinecone_index, tokenizer, model, seen_shas, batch_size, upsert_batch_size, max_workers, queue_size)
+    if migrate_legacy_ids:
+        await asyncio.to_thread(delete_legacy_vectors, repo_name, prioritized_files, pinecone_index, seen_shas)
+    return stored_count
+
+# Function to store prioritized files in Pinecone, returning the number of new vectors upserted.
+# It starts its own event loop, so it can't be called from inside a running one (async web handlers,
+# notebooks); await store_prioritized_files_in_pinecone_async there instead.
+def store_prioritized_files_in_pinecone(username, repo_name, prioritized_files, token, pinecone_index, tokenizer, model, seen_shas=None, migrate_legacy_ids=False, batch_size=16, upsert_batch_size=100, max_workers=32, queue_size=64):
+    log.debug("Inside store_prioritized_files_in_pinecone")
+
+    return asyncio.run(store_prioritized_files_in_pinecone_async(username, repo_name, prioritized_files, token, pinecone_index, tokenizer, model, seen_shas, migrate_legacy_ids, batch_size, upsert_batch_size, max_workers, queue_size))
 
 # Main function to handle GitHub profile analysis and Pinecone storage
-def analyze_and_store_in_pinecone(profile_url, token, pinecone_index_name):
-    # Debug print statement
-    print("Inside analyze_and_store_in_pinecone")
+def analyze_and_store_in_pinecone(profile_url, token, pinecone_index_name, migrate_legacy_ids=False):
+    log.debug("Inside analyze_and_store_in_pinecone")
 
     try:
         pinecone_index = initialize_pinecone(pinecone_index_name)
@@ -170,28 +310,32 @@ def analyze_and_store_in_pinecone(profile_url, token, pinecone_index_name):
         
         username = extract_username(profile_url)
         repos = get_repositories(username, token)
+        # Blob shas with a vector queued this run or already in Pinecone, shared across repositories
+        seen_shas = set()
         
         for repo in repos:
             repo_name = repo['name']
-            print(f"Processing repository: {repo_name}")
+            log.info("Processing repository: %s", repo_name)
             
-            prioritized_files = prioritize_files(username, repo_name, token)
+            prioritized_files = prioritize_files(username, repo_name, token, repo['default_branch'])
             
-            # Debug print statement
-            print(f"Number of prioritized files: {len(prioritized_files)}")
+            log.debug("Number of prioritized files: %d", len(prioritized_files))
             
-            store_prioritized_files_in_pinecone(username, repo_name, prioritized_files, token, pinecone_index, tokenizer, model)
-            print(f"Stored {len(prioritized_files)} files from {repo_name} in Pinecone.")
+            stored_count = store_prioritized_files_in_pinecone(username, repo_name, prioritized_files, token, pinecone_index, tokenizer, model, seen_shas, migrate_legacy_ids)
+            log.info("Stored %d new files from %s in Pinecone.", stored_count, repo_name)
     
     except Exception as e:
-        print(f"Error: {e}")
+        log.error("Error: %s", e)
 
 
 # Example usage
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     github_profile_url = input("Enter GitHub profile URL: ")
     # github_profile_url = "https://github.com/Akki-58/"
     github_token = os.getenv("GIT_KEY") # Input GitHub token
     pinecone_index_name = "github-code"  # Define a Pinecone index name
+    # Set MIGRATE_LEGACY_IDS=1 once to clean up an index built before vector ids became blob shas
+    migrate_legacy_ids = os.getenv("MIGRATE_LEGACY_IDS", "0") == "1"
     
-    analyze_and_store_in_pinecone(github_profile_url, github_token, pinecone_index_name)
\ No newline at end of file
+    analyze_and_store_in_pinecone(github_profile_url, github_token, pinecone_index_name, migrate_legacy_ids)
\ No newline at end of file
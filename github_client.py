@@ -0,0 +1,50 @@
+import shelve
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared HTTP session for all GitHub calls, so requests (including parallel file downloads) reuse pooled keep-alive connections.
+# allowed_methods=None also retries the GraphQL POST, which is a read-only query
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504], allowed_methods=None, raise_on_status=False)))
+
+# ETag cache for GitHub API responses; 304 replies don't count against the rate limit.
+# The lock only guards this process's threads, so each script passes its own cache file
+cache_lock = threading.Lock()
+
+# Cap on cached URLs per cache file; past it the oldest quarter of the entries is evicted
+MAX_CACHE_ENTRIES = 1000
+
+# Function to drop the oldest entries once the cache is full (called with cache_lock held)
+def evict_oldest(cache):
+    if len(cache) < MAX_CACHE_ENTRIES:
+        return
+    by_age = sorted(cache.keys(), key=lambda url: cache[url][2])
+    for url in by_age[:MAX_CACHE_ENTRIES // 4]:
+        del cache[url]
+
+# Function to GET a JSON resource, reusing the cached body when GitHub answers 304 Not Modified
+def get_json_cached(url, headers, cache_path):
+    with cache_lock, shelve.open(cache_path) as cache:
+        cached = cache.get(url)
+
+    request_headers = dict(headers)
+    if cached:
+        request_headers['If-None-Match'] = cached[0]
+
+    response = session.get(url, headers=request_headers)
+    if response.status_code == 304 and cached:
+        return 200, cached[1]
+    if response.status_code != 200:
+        return response.status_code, None
+
+    data = response.json()
+    etag = response.headers.get('ETag')
+    if etag:
+        with cache_lock, shelve.open(cache_path) as cache:
+            if url not in cache:
+                evict_oldest(cache)
+            cache[url] = (etag, data, time.time())
+    return 200, data
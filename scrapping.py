@@ -1,5 +1,15 @@
-import requests
+from github_client import session, get_json_cached
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+# ETag cache file for this script, separate from github_analyzer.py's so both can run at once
+CACHE_PATH = '.gh_cache_scraper'
+
+# File extensions to prioritize (a tuple, so str.endswith can check them all at once)
+PRIORITIZED_EXTENSIONS = ('.py', '.js', '.java', '.cpp', '.c', '.ts', '.rb', '.php')
+
+# Skip overly large files (in bytes, as reported by the tree listing)
+FILE_SIZE_THRESHOLD = 5 * 1024 * 1024
 
 # Function to extract GitHub username from the profile URL
 def extract_username(github_url):
@@ -8,76 +18,112 @@ def extract_username(github_url):
     else:
         raise ValueError("Invalid GitHub profile URL")
 
-# Function to get repositories for a user with GitHub token for authentication
-def get_repositories(username, token):
-    url = f"https://api.github.com/users/{username}/repos"
+# GraphQL query returning the metadata of a page of a user's repositories
+PROFILE_QUERY = """
+query($login: String!, $cursor: String) {
+  user(login: $login) {
+    repositories(first: 100, after: $cursor, ownerAffiliations: OWNER) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        name
+        description
+        stargazerCount
+        forkCount
+        watchers { totalCount }
+        diskUsage
+        primaryLanguage { name }
+        languages(first: 100, orderBy: {field: SIZE, direction: DESC}) { nodes { name } }
+        defaultBranchRef {
+          name
+          target { ... on Commit { history { totalCount } } }
+        }
+      }
+    }
+  }
+}
+"""
+
+# Generator yielding a user's repositories as each GraphQL page (100 repositories) arrives
+def iter_user_repos(username, token):
+    url = "https://api.github.com/graphql"
+    headers = {'Authorization': f'bearer {token}'}
+    cursor = None
+
+    while True:
+        payload = {'query': PROFILE_QUERY, 'variables': {'login': username, 'cursor': cursor}}
+        response = session.post(url, json=payload, headers=headers)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch repositories for {username}, status code: {response.status_code}")
+
+        data = response.json()
+        if data.get('errors'):
+            raise Exception(f"Failed to fetch repositories for {username}: {data['errors'][0]['message']}")
+
+        repositories = data['data']['user']['repositories']
+        yield from repositories['nodes']
+        if not repositories['pageInfo']['hasNextPage']:
+            break
+        cursor = repositories['pageInfo']['endCursor']
+
+# Function to build the details of one repository, including the REST calls GraphQL can't cover
+def get_repo_details(username, repo, token):
     headers = {'Authorization': f'token {token}'}
+    default_branch = repo['defaultBranchRef']
+    languages = [language['name'] for language in repo['languages']['nodes']]
+    details = {
+        'name': repo['name'],
+        'description': repo['description'],
+        'stars': repo['stargazerCount'],
+        'forks': repo['forkCount'],
+        'watchers': repo['watchers']['totalCount'],
+        'primary_language': repo['primaryLanguage']['name'] if repo['primaryLanguage'] else None,
+        'repo_size_kb': repo['diskUsage'],
+        'languages': languages,
+        'commits': default_branch['target']['history']['totalCount'] if default_branch else 0,
+    }
     
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch repositories for {username}, status code: {response.status_code}")
+    # GraphQL has no contributors count, so this is still a REST call
+    contributors_url = f"https://api.github.com/repos/{username}/{repo['name']}/contributors"
+    status_code, contributors = get_json_cached(contributors_url, headers, CACHE_PATH)
+    contributors = len(contributors) if status_code == 200 else 0
+    details['contributors'] = contributors
     
-    repos = response.json()
-    repo_details = []
+    # Prioritize files in the repository (empty repositories have no default branch)
+    prioritized_files = prioritize_files(username, repo['name'], token, default_branch['name']) if default_branch else []
+    details['prioritized_files'] = prioritized_files
     
-    for repo in repos:
-        details = {
-            'name': repo['name'],
-            'description': repo['description'],
-            'stars': repo['stargazers_count'],
-            'forks': repo['forks_count'],
-            'watchers': repo['watchers_count'],
-            'primary_language': repo['language'],
-            'repo_size_kb': repo['size'],
-        }
-        
-        # Fetch additional languages used
-        languages = requests.get(repo['languages_url'], headers=headers).json()
-        details['languages'] = list(languages.keys())
-        
-        # Add contributors count
-        contributors = len(requests.get(repo['contributors_url'], headers=headers).json())
-        details['contributors'] = contributors
-        
-        # Add commits count
-        commits_url = repo['commits_url'].replace("{/sha}", "")
-        commits = len(requests.get(commits_url, headers=headers).json())
-        details['commits'] = commits
-        
-        # Prioritize files in the repository
-        prioritized_files = prioritize_files(username, repo['name'], token)
-        details['prioritized_files'] = prioritized_files
-        
-        repo_details.append(details)
-    
-    return repo_details
+    return details
+
+# Function to get repositories for a user with GitHub token for authentication
+def get_repositories(username, token, max_workers=8):
+    # Per-repository work is submitted as repositories are yielded, overlapping with fetching the next page
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(get_repo_details, username, repo, token) for repo in iter_user_repos(username, token)]
+        return [future.result() for future in futures]
 
 # Function to prioritize files based on their extension, with GitHub token for authentication
-def prioritize_files(username, repo_name, token):
-    tree_url = f"https://api.github.com/repos/{username}/{repo_name}/git/trees/main?recursive=1"
+def prioritize_files(username, repo_name, token, branch):
+    tree_url = f"https://api.github.com/repos/{username}/{repo_name}/git/trees/{branch}?recursive=1"
     headers = {'Authorization': f'token {token}'}
     
-    response = requests.get(tree_url, headers=headers)
-    if response.status_code != 200:
+    status_code, tree = get_json_cached(tree_url, headers, CACHE_PATH)
+    if status_code != 200:
         return []
     
-    files = response.json().get('tree', [])
+    files = tree.get('tree', [])
     code_files = []
     
-    # Define file extensions to prioritize
-    prioritized_extensions = ['.py', '.js', '.java', '.cpp', '.c', '.ts', '.rb', '.php']
     # deprioritized_extensions = ['.json', '.csv', '.md', '.ipynb', '.txt', '.yml']
 
     # Process the files and filter/prioritize
     for file in files:
+        if file['type'] != 'blob':  # Ensure it's a file, not a directory
+            continue
         file_path = file['path']
-        file_size_kb = file['size'] / 1024 if 'size' in file else 0
 
-        # Prioritize based on extension
-        if any(file_path.endswith(ext) for ext in prioritized_extensions):
-            # Skip overly large files (example: more than 5 MB)
-            if file_size_kb < 5*1024:
-                code_files.append({'file': file_path, 'size_kb': file_size_kb})
+        # Prioritize based on extension, skipping overly large files
+        if file_path.endswith(PRIORITIZED_EXTENSIONS) and file['size'] < FILE_SIZE_THRESHOLD:
+            code_files.append({'file': file_path, 'size_kb': file['size'] / 1024})
         # elif not any(file_path.endswith(ext) for ext in deprioritized_extensions):
         #     # Include files that are neither deprioritized nor prioritized, but skip large ones
         #     if file_size_kb < 512:  # Limit for non-prioritized files